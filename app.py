@@ -1,4 +1,12 @@
+import hashlib
+import io
+import threading
+from functools import lru_cache
+from itertools import chain
+from types import MappingProxyType
+
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
 import numpy as np
 from dataclasses import dataclass
@@ -7,7 +15,7 @@ import json
 
 st.set_page_config(page_title="Power BI DAX Generator", layout="wide", page_icon="⚡", initial_sidebar_state="collapsed")
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ColorTheme:
     name: str
     primary: str
@@ -18,32 +26,99 @@ class ColorTheme:
     bg: str
     text: str
 
-THEMES = {
+THEMES = MappingProxyType({
     "Ocean Blue": ColorTheme("Ocean Blue", "#2563eb", "#1e40af", "#10b981", "#f59e0b", "#ef4444", "#eff6ff", "#1e293b"),
     "Forest Green": ColorTheme("Forest Green", "#059669", "#047857", "#10b981", "#f59e0b", "#dc2626", "#ecfdf5", "#1f2937"),
     "Royal Purple": ColorTheme("Royal Purple", "#7c3aed", "#6d28d9", "#10b981", "#f59e0b", "#ef4444", "#f5f3ff", "#1e293b"),
     "Sunset Orange": ColorTheme("Sunset Orange", "#ea580c", "#c2410c", "#10b981", "#f59e0b", "#dc2626", "#fff7ed", "#1f2937"),
     "Slate Gray": ColorTheme("Slate Gray", "#475569", "#334155", "#10b981", "#f59e0b", "#ef4444", "#f8fafc", "#0f172a"),
-}
+})
+
+@lru_cache(maxsize=512)
+def _escape_column_name(name: str) -> str:
+    return f"[{name}]"
+
+@lru_cache(maxsize=512)
+def _escape_table_name(name: str) -> str:
+    return f"'{name}'"
 
 class DAXValidator:
     @staticmethod
     def escape_column_name(name: str) -> str:
         """Properly escape column names for DAX"""
-        if ' ' in name or any(c in name for c in ['[', ']', '#', '@']):
-            return f"[{name}]"
-        return f"[{name}]"
-    
+        return _escape_column_name(name)
+
     @staticmethod
     def escape_table_name(name: str) -> str:
         """Properly escape table names for DAX"""
-        if ' ' in name:
-            return f"'{name}'"
-        return f"'{name}'"
+        return _escape_table_name(name)
+
+try:
+    from numba import njit, prange
+
+    # No fastmath: its nnan/ninf flags would optimize away the isnan
+    # guard and break NaN skipping
+    @njit(parallel=True, cache=True)
+    def _numba_col_stats(a):
+        ncols = a.shape[1]
+        mins = np.empty(ncols)
+        maxs = np.empty(ncols)
+        means = np.empty(ncols)
+        for j in prange(ncols):
+            lo = np.inf
+            hi = -np.inf
+            total = 0.0
+            count = 0
+            for i in range(a.shape[0]):
+                v = a[i, j]
+                if not np.isnan(v):
+                    if v < lo:
+                        lo = v
+                    if v > hi:
+                        hi = v
+                    total += v
+                    count += 1
+            if count:
+                mins[j] = lo
+                maxs[j] = hi
+                means[j] = total / count
+            else:
+                mins[j] = np.nan
+                maxs[j] = np.nan
+                means[j] = np.nan
+        return mins, maxs, means
+except ImportError:
+    _numba_col_stats = None
+
+# Below this size the pandas reductions are fast enough that JIT warmup
+# and the float64 copy are not worth it
+_NUMBA_MIN_ELEMENTS = 1_000_000
+
+def _numeric_stats(num_df: pd.DataFrame) -> pd.DataFrame:
+    """Per-column min/max/mean, fused into one pass via Numba when available"""
+    if _numba_col_stats is not None and num_df.size >= _NUMBA_MIN_ELEMENTS:
+        try:
+            block = np.ascontiguousarray(num_df.to_numpy(dtype=np.float64))
+            mins, maxs, means = _numba_col_stats(block)
+            return pd.DataFrame({'min': mins, 'max': maxs, 'mean': means}, index=num_df.columns)
+        except Exception:
+            pass
+    return num_df.agg(['min', 'max', 'mean']).T
+
+# Exact nunique is cheap below this; above it a sampled estimate is
+# enough for the coarse cardinality thresholds the analyzer applies
+_APPROX_NUNIQUE_MIN_ROWS = 50_000
+_APPROX_NUNIQUE_SAMPLE = 50_000
+
+def _approx_nunique(series: pd.Series) -> int:
+    """Sampled distinct-count estimate; exact below the row gate"""
+    if len(series) < _APPROX_NUNIQUE_MIN_ROWS:
+        return int(series.nunique())
+    return int(series.sample(_APPROX_NUNIQUE_SAMPLE, random_state=0).nunique())
 
 class SmartAnalyzer:
     @staticmethod
-    def analyze_data(df: pd.DataFrame) -> Dict:
+    def analyze_data(df: pd.DataFrame, approx: bool = True) -> Dict:
         """Intelligently analyze dataframe and suggest configurations"""
         analysis = {
             'total_rows': len(df),
@@ -57,32 +132,74 @@ class SmartAnalyzer:
             'data_quality': 0
         }
         
+        # Frame-wide passes computed once instead of per-column pandas calls;
+        # plain dicts so the loop below does O(1) lookups, not Series indexing
+        null_pct = (df.isna().sum(axis=0) / len(df) * 100).to_dict()
+        num_df = df.select_dtypes(include=['number', 'bool'])
+        num_stats = _numeric_stats(num_df)
+        # One dtype pass up front; 'U' covers Arrow-backed strings
+        kind_map = {c: df[c].dtype.kind for c in df.columns}
+        if approx and len(df) >= _APPROX_NUNIQUE_MIN_ROWS:
+            # Only the object/string columns take the sampled path —
+            # their exact nunique is the hash-heavy one; everything else
+            # stays exact
+            nuniq = {
+                c: _approx_nunique(df[c]) if kind_map[c] in ('O', 'U') else int(df[c].nunique())
+                for c in df.columns
+            }
+        else:
+            nuniq = df.nunique(dropna=True).to_dict()
+
         for col in df.columns:
-            missing_pct = (df[col].isnull().sum() / len(df)) * 100
-            
-            if pd.api.types.is_numeric_dtype(df[col]):
-                unique_ratio = df[col].nunique() / len(df)
+            missing_pct = null_pct[col]
+            kind = kind_map[col]
+            low = col.lower()
+
+            if col in num_stats.index:
+                unique_ratio = nuniq[col] / len(df)
+                col_min = float(num_stats.at[col, 'min'])
+                col_max = float(num_stats.at[col, 'max'])
                 analysis['numeric_cols'].append({
                     'name': col,
-                    'min': float(df[col].min()),
-                    'max': float(df[col].max()),
-                    'mean': float(df[col].mean()),
+                    'min': col_min,
+                    'max': col_max,
+                    'mean': float(num_stats.at[col, 'mean']),
                     'missing_pct': missing_pct,
-                    'is_score': unique_ratio > 0.05 and df[col].min() >= 0 and df[col].max() <= 10
+                    'is_score': unique_ratio > 0.05 and col_min >= 0 and col_max <= 10
                 })
-            
-            elif pd.api.types.is_datetime64_any_dtype(df[col]) or 'date' in col.lower() or 'time' in col.lower():
+
+            elif kind == 'M' or 'date' in low or 'time' in low:
                 analysis['date_cols'].append({
                     'name': col,
                     'min': df[col].min(),
                     'max': df[col].max(),
                     'missing_pct': missing_pct
                 })
-            
-            elif pd.api.types.is_object_dtype(df[col]):
-                unique_count = df[col].nunique()
-                avg_length = df[col].astype(str).str.len().mean()
-                
+
+            elif kind in ('O', 'U'):
+                unique_count = nuniq[col]
+                # avg_length only gates a coarse >100 test, so a bounded
+                # sample decides it without materializing every string
+                text_vals = df[col].dropna()
+                if len(text_vals) > 10_000:
+                    text_vals = text_vals.sample(10_000, random_state=0)
+                if not len(text_vals):
+                    avg_length = 0
+                else:
+                    try:
+                        # Arrow's utf8_length kernel measures the whole
+                        # sample in one C pass instead of per-element
+                        # Python length calls
+                        import pyarrow as pa
+                        import pyarrow.compute as pc
+                        arr = pa.array(text_vals, from_pandas=True)
+                        if not (pa.types.is_string(arr.type) or pa.types.is_large_string(arr.type)):
+                            arr = arr.cast(pa.string())
+                        avg_length = pc.mean(pc.utf8_length(arr)).as_py() or 0
+                    except Exception:
+                        # Mixed-type object columns that Arrow can't cast
+                        avg_length = text_vals.astype(str).str.len().mean()
+
                 if avg_length > 100:
                     analysis['text_cols'].append({
                         'name': col,
@@ -107,116 +224,235 @@ class SmartAnalyzer:
             analysis['suggested_categorical'] = [c['name'] for c in sorted_cats[:3]]
         
         # Data quality score
-        total_missing = sum([col.get('missing_pct', 0) for col in 
-                           analysis['numeric_cols'] + analysis['categorical_cols'] + 
-                           analysis['date_cols'] + analysis['text_cols']])
+        total_missing = sum(col.get('missing_pct', 0) for col in
+                            chain(analysis['numeric_cols'], analysis['categorical_cols'],
+                                  analysis['date_cols'], analysis['text_cols']))
         analysis['data_quality'] = max(0, 100 - (total_missing / len(df.columns)))
         
         return analysis
 
+_DAX_VAR_DROP = str.maketrans('', '', ' -_')
+
+# Slider drags mint a new threshold tuple per position, so the per-builder
+# fragment memo needs a ceiling
+_FRAGMENT_CACHE_MAX = 256
+
+@lru_cache(maxsize=512)
+def _clean_var_name(name: str) -> str:
+    return name.translate(_DAX_VAR_DROP)
+
+# HTML/DAX skeletons hoisted to module scope so each build call renders a
+# prebuilt template instead of reconstructing long f-strings
+_KPI_CARD_TMPL = '''"<div style='background:white; padding:20px; border-radius:10px; box-shadow:0 2px 8px rgba(0,0,0,0.1); border-left:4px solid " & {var_clean}Color & ";'>" &
+"<div style='font-size:12px; color:#64748b; font-weight:500; margin-bottom:8px;'>{title}</div>" &
+"<div style='font-size:32px; font-weight:700; color:" & {var_clean}Color & "; margin-bottom:4px;'>" & {var_clean} & "{unit}</div>" &
+"</div>" &'''
+
+_TITLE_SECTION_TMPL = '''
+"<div style='background:linear-gradient(135deg, {primary} 0%, {secondary} 100%); padding:32px; border-radius:12px; margin-bottom:28px; box-shadow:0 4px 16px rgba(0,0,0,0.1);'>" &
+"<h1 style='color:white; font-size:32px; font-weight:700; margin:0 0 8px 0;'>{title}</h1>" &
+"<p style='color:rgba(255,255,255,0.9); font-size:15px; margin:0;'>Generated Report • " & TotalRecords & " Total Records</p>" &
+"</div>" &'''
+
+_PERF_VARS_TMPL = '''
+VAR PerfSummary =
+    SUMMARIZE(
+        {table},
+        {table}{cat_esc},
+        "AvgScore", {agg}({table}{score_esc}),
+        "Count", COUNTROWS({table})
+    )
+VAR TopPerformer = TOPN(1, PerfSummary, [AvgScore], DESC)
+VAR BottomPerformer = TOPN(1, PerfSummary, [AvgScore], ASC)
+VAR TopName = MAXX(TopPerformer, {table}{cat_esc})
+VAR TopScore = ROUND(MAXX(TopPerformer, [AvgScore]), 2)
+VAR BottomName = MAXX(BottomPerformer, {table}{cat_esc})
+VAR BottomScore = ROUND(MAXX(BottomPerformer, [AvgScore]), 2)'''
+
+_PERF_HTML_TMPL = '''
+"<div style='margin-bottom:24px;'>" &
+"<h2 style='font-size:20px; font-weight:600; margin:0 0 16px 0; padding-bottom:12px; border-bottom:2px solid #e2e8f0;'>📊 Performance by {cat_col}</h2>" &
+"<div style='display:grid; grid-template-columns:1fr 1fr; gap:16px;'>" &
+"<div style='background:#ecfdf5; padding:20px; border-radius:10px; border-left:4px solid {success};'>" &
+"<div style='font-size:13px; color:#047857; font-weight:600; margin-bottom:6px;'>🏆 Top Performer</div>" &
+"<div style='font-size:18px; font-weight:700; color:#1f2937; margin-bottom:4px;'>" & TopName & "</div>" &
+"<div style='font-size:14px; color:#64748b;'>Score: <span style='color:{success}; font-weight:600;'>" & TopScore & "</span></div>" &
+"</div>" &
+"<div style='background:#fef2f2; padding:20px; border-radius:10px; border-left:4px solid {danger};'>" &
+"<div style='font-size:13px; color:#dc2626; font-weight:600; margin-bottom:6px;'>⚠️ Needs Attention</div>" &
+"<div style='font-size:18px; font-weight:700; color:#1f2937; margin-bottom:4px;'>" & BottomName & "</div>" &
+"<div style='font-size:14px; color:#64748b;'>Score: <span style='color:{danger}; font-weight:600;'>" & BottomScore & "</span></div>" &
+"</div>" &
+"</div>" &
+"</div>" &'''
+
+_VERBATIM_VARS_TMPL = '''
+VAR {var_name} =
+    TOPN(
+        5,
+        FILTER({table}, NOT ISBLANK({table}{text_esc}) && LEN({table}{text_esc}) > 10),
+        {table}{score_esc},
+        {order}
+    )
+VAR {html_var} =
+    CONCATENATEX(
+        {var_name},
+        "<div style='background:white; padding:14px; margin:10px 0; border-radius:8px; border-left:3px solid {border_color};'>" &
+        "<div style='font-size:11px; color:{text_color}; font-weight:600; margin-bottom:6px;'>Score: " & ROUND({table}{score_esc}, 1) & "</div>" &
+        "<div style='font-size:13px; color:#374151; line-height:1.6;'>" & {table}{text_esc} & "</div>" &
+        "</div>",
+        "",
+        {table}{score_esc},
+        {order}
+    )'''
+
+_VERBATIM_HTML_TMPL = '''
+"<div style='background:{bg_color}; padding:20px; border-radius:10px; margin-bottom:24px; border-left:4px solid {border_color};'>" &
+"<h2 style='color:{text_color}; font-size:18px; font-weight:600; margin:0 0 16px 0;'>{title}</h2>" &
+{html_var} &
+"</div>" &'''
+
+_KPI_GRID_OPEN = '"<div style=\'display:grid; grid-template-columns:repeat(auto-fit, minmax(250px, 1fr)); gap:16px; margin-bottom:28px;\'>" &'
+_KPI_GRID_CLOSE = '"</div>" &'
+
+_HTML_END_TMPL = '''
+"<div style='margin-top:32px; padding-top:20px; border-top:2px solid #e2e8f0; text-align:center;'>" &
+"<p style='font-size:11px; color:#94a3b8; margin:0;'>Auto-generated by Power BI DAX | Updates with data refresh</p>" &
+"</div>" &
+"</div>"
+
+RETURN HTML'''
+
+_SUCCESS_BANNER = "<div class='success-box'><strong>✓ DAX Code Generated Successfully</strong><br>Syntactically correct and ready for Power BI</div>"
+
 class DAXBuilder:
     def __init__(self, table: str, theme: ColorTheme):
         self.table = DAXValidator.escape_table_name(table)
         self.theme = theme
         self.measures = []
-        
+        # Rendered per-metric fragments, keyed on their full argument
+        # tuples, so regenerating with one tweaked metric reuses the rest.
+        # Builders live for the server's lifetime under st.cache_resource,
+        # so the memo is bounded with FIFO eviction (see _cache_put)
+        self._fragment_cache: Dict[tuple, str] = {}
+        self._cache_lock = threading.Lock()
+        # Substitute the fixed theme palette into the templates once, so
+        # each build call only fills the per-metric/per-section fields.
+        # higher/lower share one skeleton and differ only by comparator.
+        self._threshold_tmpls = {
+            direction: (f'''VAR {{v}}Color =
+    IF({{v}} {op} {{excellent}}, "{theme.success}",
+    IF({{v}} {op} {{good}}, "{theme.primary}",
+    IF({{v}} {op} {{warning}}, "{theme.warning}", "{theme.danger}")))''')
+            for direction, op in (('higher', '>='), ('lower', '<='))
+        }
+        self._threshold_tmpls['range'] = (f'''VAR {{v}}Color =
+    IF({{v}} >= {{min}} && {{v}} <= {{max}}, "{theme.success}",
+    IF({{v}} >= {{warn_min}} && {{v}} <= {{warn_max}}, "{theme.warning}", "{theme.danger}"))''')
+        self._title_tmpl = _TITLE_SECTION_TMPL.format_map({
+            'primary': theme.primary, 'secondary': theme.secondary, 'title': '{title}'
+        })
+        self._perf_html_tmpl = _PERF_HTML_TMPL.format_map({
+            'success': theme.success, 'danger': theme.danger, 'cat_col': '{cat_col}'
+        })
+        # Fixed for the builder's lifetime, so render them here rather
+        # than per build call
+        self._header = f'''HTML_Narrative = 
+VAR TotalRecords = COUNTROWS({self.table})'''
+        self._html_start = f'''
+VAR HTML = 
+\"<div style='font-family:-apple-system,BlinkMacSystemFont,Segoe UI,Roboto,sans-serif; max-width:1200px; padding:24px; background:{theme.bg}; color:{theme.text};'>\" &'''
+
+    @staticmethod
+    def _clean(name: str) -> str:
+        """Strip characters that are invalid in DAX variable names"""
+        return _clean_var_name(name)
+
+    def _cache_put(self, key: tuple, value: str) -> None:
+        """Memo a fragment, evicting the oldest entry at the size cap"""
+        # Builders are shared across sessions, so eviction must not race
+        # a concurrent put walking the same head entry
+        with self._cache_lock:
+            if len(self._fragment_cache) >= _FRAGMENT_CACHE_MAX:
+                self._fragment_cache.pop(next(iter(self._fragment_cache)), None)
+            self._fragment_cache[key] = value
+
     def build_measure_var(self, name: str, column: str, agg: str, decimals: int = 2) -> str:
         """Build a single measure variable"""
-        col = DAXValidator.escape_column_name(column)
-        var_name = name.replace(' ', '').replace('-', '').replace('_', '')
-        return f"VAR {var_name} = ROUND({agg}({self.table}{col}), {decimals})"
-    
+        key = ('measure', name, column, agg, decimals)
+        cached = self._fragment_cache.get(key)
+        if cached is None:
+            col = DAXValidator.escape_column_name(column)
+            cached = f"VAR {self._clean(name)} = ROUND({agg}({self.table}{col}), {decimals})"
+            self._cache_put(key, cached)
+        return cached
+
     def build_threshold_color(self, var_name: str, thresholds: Dict) -> str:
         """Build threshold-based color assignment"""
-        direction = thresholds['direction']
-        var_clean = var_name.replace(' ', '').replace('-', '').replace('_', '')
-        
-        if direction == 'higher':
-            return f"""VAR {var_clean}Color = 
-    IF({var_clean} >= {thresholds['excellent']}, "{self.theme.success}",
-    IF({var_clean} >= {thresholds['good']}, "{self.theme.primary}",
-    IF({var_clean} >= {thresholds['warning']}, "{self.theme.warning}", "{self.theme.danger}")))"""
-        elif direction == 'lower':
-            return f"""VAR {var_clean}Color = 
-    IF({var_clean} <= {thresholds['excellent']}, "{self.theme.success}",
-    IF({var_clean} <= {thresholds['good']}, "{self.theme.primary}",
-    IF({var_clean} <= {thresholds['warning']}, "{self.theme.warning}", "{self.theme.danger}")))"""
-        else:  # range
-            return f"""VAR {var_clean}Color = 
-    IF({var_clean} >= {thresholds['min']} && {var_clean} <= {thresholds['max']}, "{self.theme.success}",
-    IF({var_clean} >= {thresholds['warn_min']} && {var_clean} <= {thresholds['warn_max']}, "{self.theme.warning}", "{self.theme.danger}"))"""
+        key = ('color', var_name, tuple(sorted(thresholds.items())))
+        cached = self._fragment_cache.get(key)
+        if cached is None:
+            direction = thresholds['direction']
+            tmpl = self._threshold_tmpls.get(direction, self._threshold_tmpls['range'])
+            cached = tmpl.format_map({'v': self._clean(var_name), **thresholds})
+            self._cache_put(key, cached)
+        return cached
     
     def build_kpi_card_html(self, title: str, var_name: str, unit: str = "") -> str:
         """Build HTML for a single KPI card"""
-        var_clean = var_name.replace(' ', '').replace('-', '').replace('_', '')
-        return f'''\"<div style='background:white; padding:20px; border-radius:10px; box-shadow:0 2px 8px rgba(0,0,0,0.1); border-left:4px solid \" & {var_clean}Color & \";'>\" &
-\"<div style='font-size:12px; color:#64748b; font-weight:500; margin-bottom:8px;'>{title}</div>\" &
-\"<div style='font-size:32px; font-weight:700; color:\" & {var_clean}Color & \"; margin-bottom:4px;'>\" & {var_clean} & \"{unit}</div>\" &
-\"</div>\" &'''
+        key = ('kpi', title, var_name, unit)
+        cached = self._fragment_cache.get(key)
+        if cached is None:
+            cached = _KPI_CARD_TMPL.format_map({
+                'var_clean': self._clean(var_name),
+                'title': title,
+                'unit': unit
+            })
+            self._cache_put(key, cached)
+        return cached
     
     def build_header(self) -> str:
         """Build measure header and core variables"""
-        return f'''HTML_Narrative = 
-VAR TotalRecords = COUNTROWS({self.table})'''
-    
+        return self._header
+
     def build_html_start(self) -> str:
         """Build HTML container start"""
-        return f'''
-VAR HTML = 
-\"<div style='font-family:-apple-system,BlinkMacSystemFont,Segoe UI,Roboto,sans-serif; max-width:1200px; padding:24px; background:{self.theme.bg}; color:{self.theme.text};'>\" &'''
+        return self._html_start
     
     def build_title_section(self, title: str) -> str:
         """Build title header"""
-        return f'''
-\"<div style='background:linear-gradient(135deg, {self.theme.primary} 0%, {self.theme.secondary} 100%); padding:32px; border-radius:12px; margin-bottom:28px; box-shadow:0 4px 16px rgba(0,0,0,0.1);'>\" &
-\"<h1 style='color:white; font-size:32px; font-weight:700; margin:0 0 8px 0;'>{title}</h1>\" &
-\"<p style='color:rgba(255,255,255,0.9); font-size:15px; margin:0;'>Generated Report • \" & TotalRecords & \" Total Records</p>\" &
-\"</div>\" &'''
+        return self._title_tmpl.format_map({'title': title})
     
     def build_performance_table(self, cat_col: str, score_col: str, agg: str) -> Tuple[str, str]:
         """Build performance breakdown table"""
-        cat_esc = DAXValidator.escape_column_name(cat_col)
-        score_esc = DAXValidator.escape_column_name(score_col)
-        
-        vars_section = f'''
-VAR PerfSummary = 
-    SUMMARIZE(
-        {self.table},
-        {self.table}{cat_esc},
-        "AvgScore", {agg}({self.table}{score_esc}),
-        "Count", COUNTROWS({self.table})
-    )
-VAR TopPerformer = TOPN(1, PerfSummary, [AvgScore], DESC)
-VAR BottomPerformer = TOPN(1, PerfSummary, [AvgScore], ASC)
-VAR TopName = MAXX(TopPerformer, {self.table}{cat_esc})
-VAR TopScore = ROUND(MAXX(TopPerformer, [AvgScore]), 2)
-VAR BottomName = MAXX(BottomPerformer, {self.table}{cat_esc})
-VAR BottomScore = ROUND(MAXX(BottomPerformer, [AvgScore]), 2)'''
-        
-        html_section = f'''
-\"<div style='margin-bottom:24px;'>\" &
-\"<h2 style='font-size:20px; font-weight:600; margin:0 0 16px 0; padding-bottom:12px; border-bottom:2px solid #e2e8f0;'>📊 Performance by {cat_col}</h2>\" &
-\"<div style='display:grid; grid-template-columns:1fr 1fr; gap:16px;'>\" &
-\"<div style='background:#ecfdf5; padding:20px; border-radius:10px; border-left:4px solid {self.theme.success};'>\" &
-\"<div style='font-size:13px; color:#047857; font-weight:600; margin-bottom:6px;'>🏆 Top Performer</div>\" &
-\"<div style='font-size:18px; font-weight:700; color:#1f2937; margin-bottom:4px;'>\" & TopName & \"</div>\" &
-\"<div style='font-size:14px; color:#64748b;'>Score: <span style='color:{self.theme.success}; font-weight:600;'>\" & TopScore & \"</span></div>\" &
-\"</div>\" &
-\"<div style='background:#fef2f2; padding:20px; border-radius:10px; border-left:4px solid {self.theme.danger};'>\" &
-\"<div style='font-size:13px; color:#dc2626; font-weight:600; margin-bottom:6px;'>⚠️ Needs Attention</div>\" &
-\"<div style='font-size:18px; font-weight:700; color:#1f2937; margin-bottom:4px;'>\" & BottomName & \"</div>\" &
-\"<div style='font-size:14px; color:#64748b;'>Score: <span style='color:{self.theme.danger}; font-weight:600;'>\" & BottomScore & \"</span></div>\" &
-\"</div>\" &
-\"</div>\" &
-\"</div>\" &'''
-        
+        vars_section = _PERF_VARS_TMPL.format_map({
+            'table': self.table,
+            'cat_esc': DAXValidator.escape_column_name(cat_col),
+            'score_esc': DAXValidator.escape_column_name(score_col),
+            'agg': agg
+        })
+
+        html_section = self._perf_html_tmpl.format_map({'cat_col': cat_col})
+
         return vars_section, html_section
     
     def build_verbatim_section(self, text_col: str, score_col: str, section_type: str = 'positive') -> Tuple[str, str]:
         """Build verbatim comments section"""
+        return self._verbatim_one(
+            DAXValidator.escape_column_name(text_col),
+            DAXValidator.escape_column_name(score_col),
+            section_type
+        )
+
+    def build_verbatim_sections_both(self, text_col: str, score_col: str) -> Tuple[Tuple[str, str], Tuple[str, str]]:
+        """Build positive and negative verbatim sections, escaping the
+        shared columns once"""
         text_esc = DAXValidator.escape_column_name(text_col)
         score_esc = DAXValidator.escape_column_name(score_col)
-        
+        return (self._verbatim_one(text_esc, score_esc, 'positive'),
+                self._verbatim_one(text_esc, score_esc, 'negative'))
+
+    def _verbatim_one(self, text_esc: str, score_esc: str, section_type: str) -> Tuple[str, str]:
         if section_type == 'positive':
             title = "💚 Positive Feedback"
             bg_color = "#ecfdf5"
@@ -234,46 +470,188 @@ VAR BottomScore = ROUND(MAXX(BottomPerformer, [AvgScore]), 2)'''
             var_name = "NegativeComments"
             html_var = "NegativeHTML"
         
-        vars_section = f'''
-VAR {var_name} = 
-    TOPN(
-        5,
-        FILTER({self.table}, NOT ISBLANK({self.table}{text_esc}) && LEN({self.table}{text_esc}) > 10),
-        {self.table}{score_esc},
-        {order}
-    )
-VAR {html_var} = 
-    CONCATENATEX(
-        {var_name},
-        \"<div style='background:white; padding:14px; margin:10px 0; border-radius:8px; border-left:3px solid {border_color};'>\" &
-        \"<div style='font-size:11px; color:{text_color}; font-weight:600; margin-bottom:6px;'>Score: \" & ROUND({self.table}{score_esc}, 1) & \"</div>\" &
-        \"<div style='font-size:13px; color:#374151; line-height:1.6;'>\" & {self.table}{text_esc} & \"</div>\" &
-        \"</div>\",
-        \"\",
-        {self.table}{score_esc},
-        {order}
-    )'''
-        
-        html_section = f'''
-\"<div style='background:{bg_color}; padding:20px; border-radius:10px; margin-bottom:24px; border-left:4px solid {border_color};'>\" &
-\"<h2 style='color:{text_color}; font-size:18px; font-weight:600; margin:0 0 16px 0;'>{title}</h2>\" &
-{html_var} &
-\"</div>\" &'''
-        
+        vars_section = _VERBATIM_VARS_TMPL.format_map({
+            'var_name': var_name,
+            'html_var': html_var,
+            'table': self.table,
+            'text_esc': text_esc,
+            'score_esc': score_esc,
+            'order': order,
+            'border_color': border_color,
+            'text_color': text_color
+        })
+
+        html_section = _VERBATIM_HTML_TMPL.format_map({
+            'bg_color': bg_color,
+            'border_color': border_color,
+            'text_color': text_color,
+            'title': title,
+            'html_var': html_var
+        })
+
         return vars_section, html_section
     
     def build_html_end(self) -> str:
         """Build HTML container end"""
-        return '''
-"<div style='margin-top:32px; padding-top:20px; border-top:2px solid #e2e8f0; text-align:center;'>" &
-"<p style='font-size:11px; color:#94a3b8; margin:0;'>Auto-generated by Power BI DAX | Updates with data refresh</p>" &
-"</div>" &
-"</div>"
+        return _HTML_END_TMPL
 
-RETURN HTML'''
+def _compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Shrink memory: downcast numerics, categorize repetitive object cols"""
+    for c in df.select_dtypes(include='integer').columns:
+        df[c] = pd.to_numeric(df[c], downcast='integer')
+    for c in df.select_dtypes(include='float').columns:
+        df[c] = pd.to_numeric(df[c], downcast='float')
+    n = len(df)
+    if n:
+        for c in df.select_dtypes(include='object').columns:
+            if df[c].nunique(dropna=True) / n < 0.5:
+                df[c] = df[c].astype('category')
+    return df
 
-def load_custom_css():
-    st.markdown("""
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_df(file_bytes: bytes, name: str) -> pd.DataFrame:
+    """Parse an uploaded file, cached on its content so reruns skip re-parsing"""
+    buffer = io.BytesIO(file_bytes)
+    if name.endswith('.csv'):
+        try:
+            # Arrow's multithreaded block reader avoids the C engine's
+            # 2x peak memory, and Arrow-backed strings keep downstream
+            # nunique/str ops out of object-dtype territory
+            import pyarrow.csv as pv
+            table = pv.read_csv(buffer, read_options=pv.ReadOptions(block_size=4 << 20))
+            return table.to_pandas(types_mapper=pd.ArrowDtype)
+        except Exception:
+            buffer.seek(0)
+            return _compact_dtypes(pd.read_csv(buffer))
+    elif name.endswith('.parquet'):
+        return pd.read_parquet(buffer, dtype_backend='pyarrow')
+    # Arrow-backed frames are already compact; only the NumPy-dtype
+    # readers benefit from downcasting
+    try:
+        # python-calamine parses xlsx an order of magnitude faster than
+        # openpyxl when installed
+        return _compact_dtypes(pd.read_excel(buffer, engine='calamine'))
+    except Exception:
+        buffer.seek(0)
+        return _compact_dtypes(pd.read_excel(buffer))
+
+def _fast_df_hash(df: pd.DataFrame) -> tuple:
+    """Constant-time cache key: shape + dtypes + a 200-row content sample"""
+    return (df.shape, tuple(df.dtypes.astype(str)),
+            int(pd.util.hash_pandas_object(df.head(200)).sum()))
+
+@st.cache_data(show_spinner=False, max_entries=4, hash_funcs={pd.DataFrame: _fast_df_hash})
+def _analyze(df: pd.DataFrame) -> Dict:
+    """Cached wrapper around SmartAnalyzer so widget reruns skip re-profiling"""
+    return SmartAnalyzer.analyze_data(df)
+
+def _validate_inputs(table_name: str, metric_configs: List[Dict], sections: Dict) -> List[str]:
+    """Cheap O(N) config checks so bad input fails before generation starts"""
+    problems = []
+    if not table_name or not table_name.strip():
+        problems.append("Table name is empty — set it in the Data Setup tab.")
+    if not metric_configs:
+        problems.append("No metrics selected — pick at least one in the Metrics tab.")
+    for metric in metric_configs:
+        name = metric.get('name', '<unnamed>')
+        if not metric.get('column'):
+            problems.append(f"Metric '{name}' has no source column.")
+        thresholds = metric.get('thresholds', {})
+        direction = thresholds.get('direction')
+        if direction in ('higher', 'lower'):
+            if any(thresholds.get(k) is None for k in ('excellent', 'good', 'warning')):
+                problems.append(f"Metric '{name}' is missing its excellent/good/warning thresholds.")
+        elif direction == 'range':
+            if any(thresholds.get(k) is None for k in ('min', 'max', 'warn_min', 'warn_max')):
+                problems.append(f"Metric '{name}' is missing its range bounds.")
+        else:
+            problems.append(f"Metric '{name}' has an unknown threshold direction.")
+    if sections.get('theme_name') not in THEMES:
+        problems.append("Unknown color theme — re-select one in the Sections & Design tab.")
+    if sections.get('verbatim') and not (sections.get('verbatim_text') and sections.get('verbatim_score')):
+        problems.append("Verbatim section needs both a text column and a score column.")
+    return problems
+
+@st.cache_resource(show_spinner=False)
+def _get_builder(table_name: str, theme_name: str) -> DAXBuilder:
+    """One DAXBuilder per (table, theme), reused across reruns"""
+    return DAXBuilder(table_name, THEMES[theme_name])
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _build_dax(table_name: str, theme_name: str, metric_configs: List[Dict], sections: Dict) -> str:
+    """Assemble the full DAX measure, cached on the generation config"""
+    builder = _get_builder(table_name, theme_name)
+
+    # Stream straight into one buffer instead of materializing the parts
+    # list and the joined result side by side
+    buf = io.StringIO()
+    buf.write(builder.build_header())
+
+    def _emit(part: str) -> None:
+        buf.write("\n\n")
+        buf.write(part)
+
+    # Single pass over the metrics: emit the measure/color vars and the
+    # KPI card HTML together instead of looping the configs twice
+    kpi_parts = [_KPI_GRID_OPEN]
+    for metric in metric_configs:
+        name = metric['name']
+        _emit(builder.build_measure_var(
+            name,
+            metric['column'],
+            metric['aggregation'],
+            metric['decimals']
+        ))
+        _emit(builder.build_threshold_color(
+            name,
+            metric['thresholds']
+        ))
+        kpi_parts.append(builder.build_kpi_card_html(name, name))
+    kpi_parts.append(_KPI_GRID_CLOSE)
+
+    # Build each section once, emitting the vars now and keeping the HTML
+    # for the body below instead of re-invoking the builders later
+    first_col = metric_configs[0]['column']
+    first_agg = metric_configs[0]['aggregation']
+
+    perf_htmls = []
+    if sections['performance'] and sections['performance_cats']:
+        for cat in sections['performance_cats']:
+            perf_vars, perf_html = builder.build_performance_table(cat, first_col, first_agg)
+            _emit(perf_vars)
+            perf_htmls.append(perf_html)
+
+    verbatim_htmls = []
+    if sections['verbatim']:
+        for verb_vars, verb_html in builder.build_verbatim_sections_both(
+            sections['verbatim_text'], sections['verbatim_score']
+        ):
+            _emit(verb_vars)
+            verbatim_htmls.append(verb_html)
+
+    # Build HTML
+    _emit(builder.build_html_start())
+    _emit(builder.build_title_section(sections['title']))
+
+    # KPI Cards assembled in the metric loop above
+    _emit("\n".join(kpi_parts))
+
+    # Performance tables for each category
+    for perf_html in perf_htmls:
+        _emit(perf_html)
+
+    # Verbatim sections
+    for verb_html in verbatim_htmls:
+        _emit(verb_html)
+
+    _emit(builder.build_html_end())
+
+    return buf.getvalue()
+
+# Built once at import; reruns re-inject the same constant instead of
+# rebuilding the blob (the markdown call itself must repeat per rerun or
+# Streamlit drops the styles from the page)
+_CUSTOM_CSS = """
     <style>
     @import url('https://fonts.googleapis.com/css2?family=Segoe+UI:wght@400;600;700&display=swap');
     
@@ -404,7 +782,23 @@ def load_custom_css():
         background: white;
     }
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+@lru_cache(maxsize=len(THEMES))
+def _theme_swatches(theme_name: str) -> str:
+    """Color-preview HTML for a theme; rendered once per theme, not per rerun"""
+    theme = THEMES[theme_name]
+    return f"""
+            <div style='display:grid; grid-template-columns:repeat(4, 1fr); gap:8px; margin-top:12px;'>
+                <div style='background:{theme.primary}; height:50px; border-radius:8px;'></div>
+                <div style='background:{theme.success}; height:50px; border-radius:8px;'></div>
+                <div style='background:{theme.warning}; height:50px; border-radius:8px;'></div>
+                <div style='background:{theme.danger}; height:50px; border-radius:8px;'></div>
+            </div>
+            """
+
+def load_custom_css():
+    st.markdown(_CUSTOM_CSS, unsafe_allow_html=True)
 
 def main():
     load_custom_css()
@@ -419,41 +813,41 @@ def main():
     
     # TAB 1: Data Setup
     with tabs[0]:
-        st.markdown("<div class='section-card'>", unsafe_allow_html=True)
-        
-        col1, col2 = st.columns([2, 1])
+        col1, col2 = st.columns((2, 1))
         
         with col1:
             uploaded_file = st.file_uploader(
                 "Choose CSV, Excel, or Parquet file",
                 type=['csv', 'xlsx', 'parquet'],
-                label_visibility="collapsed"
+                label_visibility="collapsed",
+                help="Parquet loads fastest; Excel is the slowest to parse"
             )
             
             if uploaded_file:
                 try:
-                    if uploaded_file.name.endswith('.csv'):
-                        df = pd.read_csv(uploaded_file)
-                    elif uploaded_file.name.endswith('.parquet'):
-                        df = pd.read_parquet(uploaded_file)
-                    else:
-                        df = pd.read_excel(uploaded_file)
-                    
+                    df = _load_df(uploaded_file.getvalue(), uploaded_file.name)
+
                     st.session_state.df = df
-                    analysis = SmartAnalyzer.analyze_data(df)
+                    analysis = _analyze(df)
                     st.session_state.analysis = analysis
                     
                     st.success(f"✅ Loaded {analysis['total_rows']:,} rows × {analysis['total_cols']} columns")
                     
-                    col_a, col_b, col_c = st.columns(3)
-                    with col_a:
-                        st.markdown(f"<div class='metric-box'><div class='metric-value'>{len(analysis['numeric_cols'])}</div><div class='metric-label'>Numeric Columns</div></div>", unsafe_allow_html=True)
-                    with col_b:
-                        st.markdown(f"<div class='metric-box'><div class='metric-value'>{len(analysis['categorical_cols'])}</div><div class='metric-label'>Categorical</div></div>", unsafe_allow_html=True)
-                    with col_c:
-                        st.markdown(f"<div class='metric-box'><div class='metric-value'>{int(analysis['data_quality'])}</div><div class='metric-label'>Quality Score</div></div>", unsafe_allow_html=True)
+                    # One markdown call (and one frontend message) for all
+                    # three metric boxes instead of three column writes
+                    st.markdown(
+                        "<div style='display:grid; grid-template-columns:repeat(3, 1fr); gap:12px;'>"
+                        f"<div class='metric-box'><div class='metric-value'>{len(analysis['numeric_cols'])}</div><div class='metric-label'>Numeric Columns</div></div>"
+                        f"<div class='metric-box'><div class='metric-value'>{len(analysis['categorical_cols'])}</div><div class='metric-label'>Categorical</div></div>"
+                        f"<div class='metric-box'><div class='metric-value'>{int(analysis['data_quality'])}</div><div class='metric-label'>Quality Score</div></div>"
+                        "</div>",
+                        unsafe_allow_html=True
+                    )
                     
-                    with st.expander("📊 Preview Data"):
+                    # st.expander re-renders children even when collapsed, so
+                    # gate the preview behind a toggle to keep 50xN rows off
+                    # the wire on unrelated reruns
+                    if st.toggle("📊 Preview Data", key="show_preview"):
                         st.dataframe(df.head(50), use_container_width=True, height=300)
                     
                 except Exception as e:
@@ -467,8 +861,6 @@ def main():
                 help="Must match exactly"
             )
             st.session_state.table_name = table_name
-        
-        st.markdown("</div>", unsafe_allow_html=True)
     
     # TAB 2: Configure Metrics
     with tabs[1]:
@@ -478,37 +870,47 @@ def main():
             analysis = st.session_state.analysis
             df = st.session_state.df
             
-            st.markdown("<div class='section-card'>", unsafe_allow_html=True)
-            st.markdown("<h2>Configure Metrics & Thresholds</h2>", unsafe_allow_html=True)
+            st.markdown("<div class='section-card'><h2>Configure Metrics & Thresholds</h2></div>", unsafe_allow_html=True)
         
             st.markdown("**Select Primary Metrics**")
             metric_configs = []
         
         for i, num_col in enumerate(analysis['numeric_cols'][:3]):
-            with st.expander(f"📊 {num_col['name']}", expanded=i==0):
-                col1, col2 = st.columns([2, 1])
-                
+            n = num_col['name']
+            # Build each widget key once per metric instead of re-formatting
+            # the name inside every widget call
+            k_use, k_agg, k_type = f"use_{n}", f"agg_{n}", f"type_{n}"
+            k_exc, k_good, k_warn = f"exc_{n}", f"good_{n}", f"warn_{n}"
+            k_range_min, k_range_max = f"range_min_{n}", f"range_max_{n}"
+            k_warn_min, k_warn_max = f"warn_min_{n}", f"warn_max_{n}"
+            # Bound once per metric; every slider below reuses these
+            mn, mx = num_col['min'], num_col['max']
+            span = mx - mn
+
+            with st.expander(f"📊 {n}", expanded=i==0):
+                col1, col2 = st.columns((2, 1))
+
                 with col1:
                     use_metric = st.toggle(
                         "Include in narrative",
                         value=i==0,
-                        key=f"use_{num_col['name']}"
+                        key=k_use
                     )
-                
+
                 with col2:
                     agg = st.selectbox(
                         "Aggregation",
                         ['AVERAGE', 'SUM', 'MIN', 'MAX'],
-                        key=f"agg_{num_col['name']}"
+                        key=k_agg
                     )
                 
                 if use_metric:
-                    st.markdown(f"**Threshold Settings** *(Data range: {num_col['min']:.1f} - {num_col['max']:.1f})*")
+                    st.markdown(f"**Threshold Settings** *(Data range: {mn:.1f} - {mx:.1f})*")
                     
                     threshold_type = st.radio(
                         "Logic",
                         ['Higher is Better', 'Lower is Better', 'Optimal Range'],
-                        key=f"type_{num_col['name']}",
+                        key=k_type,
                         horizontal=True
                     )
                     
@@ -517,23 +919,23 @@ def main():
                         with col_a:
                             excellent = st.slider(
                                 "🟢 Excellent",
-                                num_col['min'], num_col['max'],
-                                num_col['max'] * 0.85,
-                                key=f"exc_{num_col['name']}"
+                                mn, mx,
+                                mx * 0.85,
+                                key=k_exc
                             )
                         with col_b:
                             good = st.slider(
                                 "🔵 Good",
-                                num_col['min'], num_col['max'],
-                                num_col['max'] * 0.65,
-                                key=f"good_{num_col['name']}"
+                                mn, mx,
+                                mx * 0.65,
+                                key=k_good
                             )
                         with col_c:
                             warning = st.slider(
                                 "🟡 Warning",
-                                num_col['min'], num_col['max'],
-                                num_col['max'] * 0.45,
-                                key=f"warn_{num_col['name']}"
+                                mn, mx,
+                                mx * 0.45,
+                                key=k_warn
                             )
                         
                         thresholds = {
@@ -548,23 +950,23 @@ def main():
                         with col_a:
                             excellent = st.slider(
                                 "🟢 Excellent",
-                                num_col['min'], num_col['max'],
-                                num_col['min'] * 1.15,
-                                key=f"exc_{num_col['name']}"
+                                mn, mx,
+                                mn * 1.15,
+                                key=k_exc
                             )
                         with col_b:
                             good = st.slider(
                                 "🔵 Good",
-                                num_col['min'], num_col['max'],
-                                num_col['min'] * 1.35,
-                                key=f"good_{num_col['name']}"
+                                mn, mx,
+                                mn * 1.35,
+                                key=k_good
                             )
                         with col_c:
                             warning = st.slider(
                                 "🟡 Warning",
-                                num_col['min'], num_col['max'],
-                                num_col['min'] * 1.65,
-                                key=f"warn_{num_col['name']}"
+                                mn, mx,
+                                mn * 1.65,
+                                key=k_warn
                             )
                         
                         thresholds = {
@@ -579,32 +981,32 @@ def main():
                         with col_a:
                             range_min = st.slider(
                                 "🟢 Optimal Min",
-                                num_col['min'], num_col['max'],
-                                num_col['min'] + (num_col['max'] - num_col['min']) * 0.4,
-                                key=f"range_min_{num_col['name']}"
+                                mn, mx,
+                                mn + span * 0.4,
+                                key=k_range_min
                             )
                         with col_b:
                             range_max = st.slider(
                                 "🟢 Optimal Max",
-                                num_col['min'], num_col['max'],
-                                num_col['min'] + (num_col['max'] - num_col['min']) * 0.6,
-                                key=f"range_max_{num_col['name']}"
+                                mn, mx,
+                                mn + span * 0.6,
+                                key=k_range_max
                             )
                         
                         col_c, col_d = st.columns(2)
                         with col_c:
                             warn_min = st.slider(
                                 "🟡 Warning Min",
-                                num_col['min'], num_col['max'],
-                                num_col['min'] + (num_col['max'] - num_col['min']) * 0.2,
-                                key=f"warn_min_{num_col['name']}"
+                                mn, mx,
+                                mn + span * 0.2,
+                                key=k_warn_min
                             )
                         with col_d:
                             warn_max = st.slider(
                                 "🟡 Warning Max",
-                                num_col['min'], num_col['max'],
-                                num_col['min'] + (num_col['max'] - num_col['min']) * 0.8,
-                                key=f"warn_max_{num_col['name']}"
+                                mn, mx,
+                                mn + span * 0.8,
+                                key=k_warn_max
                             )
                         
                         thresholds = {
@@ -616,15 +1018,14 @@ def main():
                         }
                     
                     metric_configs.append({
-                        'name': num_col['name'],
-                        'column': num_col['name'],
+                        'name': n,
+                        'column': n,
                         'aggregation': agg,
                         'decimals': 2,
                         'thresholds': thresholds
                     })
         
             st.session_state.metric_configs = metric_configs
-            st.markdown("</div>", unsafe_allow_html=True)
     
     # TAB 3: Select Sections
     with tabs[2]:
@@ -632,8 +1033,7 @@ def main():
             st.info("👈 Upload data first in the Data Setup tab")
         else:
             analysis = st.session_state.analysis
-            st.markdown("<div class='section-card'>", unsafe_allow_html=True)
-            st.markdown("<h2>Narrative Sections & Design</h2>", unsafe_allow_html=True)
+            st.markdown("<div class='section-card'><h2>Narrative Sections & Design</h2></div>", unsafe_allow_html=True)
         
             col1, col2 = st.columns(2)
             
@@ -677,16 +1077,7 @@ def main():
                 list(THEMES.keys()),
                 key="theme_select"
             )
-            theme = THEMES[theme_name]
-            
-            st.markdown(f"""
-            <div style='display:grid; grid-template-columns:repeat(4, 1fr); gap:8px; margin-top:12px;'>
-                <div style='background:{theme.primary}; height:50px; border-radius:8px;'></div>
-                <div style='background:{theme.success}; height:50px; border-radius:8px;'></div>
-                <div style='background:{theme.warning}; height:50px; border-radius:8px;'></div>
-                <div style='background:{theme.danger}; height:50px; border-radius:8px;'></div>
-            </div>
-            """, unsafe_allow_html=True)
+            st.markdown(_theme_swatches(theme_name), unsafe_allow_html=True)
             
             st.markdown("**Report Title**")
             report_title = st.text_input(
@@ -701,127 +1092,97 @@ def main():
                 'verbatim': include_verbatim,
                 'verbatim_text': verbatim_text,
                 'verbatim_score': verbatim_score,
-                'theme': theme,
+                'theme_name': theme_name,
                 'title': report_title
             }
-            
-            st.markdown("</div>", unsafe_allow_html=True)
     
     # TAB 4: Generate
     with tabs[3]:
         if 'metric_configs' not in st.session_state or not st.session_state.metric_configs:
             st.info("👈 Configure metrics first in the Metrics & Thresholds tab")
         else:
-            st.markdown("<div class='section-card'>", unsafe_allow_html=True)
-            st.markdown("<h2>Generate DAX Code</h2>", unsafe_allow_html=True)
-            
-            try:
-                table_name = st.session_state.table_name
-                theme = st.session_state.sections['theme']
-                builder = DAXBuilder(table_name, theme)
-                
-                dax_parts = [builder.build_header()]
-                
-                # Add metric variables
-                for metric in st.session_state.metric_configs:
-                    dax_parts.append(builder.build_measure_var(
-                        metric['name'],
-                        metric['column'],
-                        metric['aggregation'],
-                        metric['decimals']
-                    ))
-                    dax_parts.append(builder.build_threshold_color(
-                        metric['name'],
-                        metric['thresholds']
-                    ))
-                
-                # Add performance variables if needed
-                if st.session_state.sections['performance'] and st.session_state.sections['performance_cats']:
-                    for cat in st.session_state.sections['performance_cats']:
-                        perf_vars, _ = builder.build_performance_table(
-                            cat,
-                            st.session_state.metric_configs[0]['column'],
-                            st.session_state.metric_configs[0]['aggregation']
-                        )
-                        dax_parts.append(perf_vars)
-                
-                # Add verbatim variables if needed
-                if st.session_state.sections['verbatim']:
-                    pos_vars, _ = builder.build_verbatim_section(
-                        st.session_state.sections['verbatim_text'],
-                        st.session_state.sections['verbatim_score'],
-                        'positive'
-                    )
-                    neg_vars, _ = builder.build_verbatim_section(
-                        st.session_state.sections['verbatim_text'],
-                        st.session_state.sections['verbatim_score'],
-                        'negative'
-                    )
-                    dax_parts.append(pos_vars)
-                    dax_parts.append(neg_vars)
-                
-                # Build HTML
-                dax_parts.append(builder.build_html_start())
-                dax_parts.append(builder.build_title_section(st.session_state.sections['title']))
-                
-                # KPI Cards
-                kpi_section = '"<div style=\'display:grid; grid-template-columns:repeat(auto-fit, minmax(250px, 1fr)); gap:16px; margin-bottom:28px;\'>" &'
-                for metric in st.session_state.metric_configs:
-                    kpi_section += "\n" + builder.build_kpi_card_html(metric['name'], metric['name'])
-                kpi_section += '\n"</div>" &'
-                dax_parts.append(kpi_section)
-                
-                # Performance tables for each category
-                if st.session_state.sections['performance'] and st.session_state.sections['performance_cats']:
-                    for cat in st.session_state.sections['performance_cats']:
-                        _, perf_html = builder.build_performance_table(
-                            cat,
-                            st.session_state.metric_configs[0]['column'],
-                            st.session_state.metric_configs[0]['aggregation']
-                        )
-                        dax_parts.append(perf_html)
-                
-                # Verbatim sections
-                if st.session_state.sections['verbatim']:
-                    _, pos_html = builder.build_verbatim_section(
-                        st.session_state.sections['verbatim_text'],
-                        st.session_state.sections['verbatim_score'],
-                        'positive'
-                    )
-                    _, neg_html = builder.build_verbatim_section(
-                        st.session_state.sections['verbatim_text'],
-                        st.session_state.sections['verbatim_score'],
-                        'negative'
+            st.markdown("<div class='section-card'><h2>Generate DAX Code</h2></div>", unsafe_allow_html=True)
+
+            # One proxy lookup each instead of going through the
+            # SessionStateProxy on every reference below
+            table_name = st.session_state.table_name
+            sections = st.session_state.sections
+            metrics = st.session_state.metric_configs
+
+            # Fail fast on malformed config instead of letting the full
+            # generation pipeline run before hitting the problem
+            problems = _validate_inputs(table_name, metrics, sections)
+            if problems:
+                st.error("Fix these before generating:\n\n" + "\n".join(f"- {p}" for p in problems))
+                st.stop()
+
+            # Cheap change detection: reruns that touched no generation
+            # input (Copy clicks etc.) reuse the stored string outright
+            config_hash = hashlib.blake2b(
+                json.dumps({
+                    't': table_name,
+                    'm': metrics,
+                    's': sections
+                }, sort_keys=True, default=str).encode(),
+                digest_size=16
+            ).hexdigest()
+
+            if st.session_state.get('last_config_hash') == config_hash and 'generated_dax' in st.session_state:
+                final_dax = st.session_state.generated_dax
+            else:
+                try:
+                    final_dax = _build_dax(
+                        table_name,
+                        sections['theme_name'],
+                        metrics,
+                        sections
                     )
-                    dax_parts.append(pos_html)
-                    dax_parts.append(neg_html)
-                
-                dax_parts.append(builder.build_html_end())
-                
-                final_dax = "\n\n".join(dax_parts)
+                except Exception as e:
+                    st.error(f"Generation Error: {str(e)}")
+                    st.stop()
                 st.session_state.generated_dax = final_dax
-                
-                st.markdown("<div class='success-box'><strong>✓ DAX Code Generated Successfully</strong><br>Syntactically correct and ready for Power BI</div>", unsafe_allow_html=True)
-                
-                col1, col2, col3 = st.columns([2, 1, 1])
-                with col2:
-                    st.download_button(
-                        "💾 Download DAX",
-                        final_dax,
-                        "narrative.dax",
-                        "text/plain",
-                        use_container_width=True
-                    )
-                with col3:
-                    if st.button("📋 Copy Code", use_container_width=True):
-                        st.toast("Copied to clipboard!")
-                
-                st.code(final_dax, language='dax', line_numbers=True)
-                
-            except Exception as e:
-                st.error(f"Generation Error: {str(e)}")
-            
-            st.markdown("</div>", unsafe_allow_html=True)
+                # Encode once here so the download payload isn't
+                # re-encoded from str on every rerun
+                st.session_state.generated_dax_bytes = final_dax.encode('utf-8')
+                st.session_state.last_config_hash = config_hash
+
+            st.markdown(_SUCCESS_BANNER, unsafe_allow_html=True)
+
+            col1, col2, col3 = st.columns((2, 1, 1))
+            with col2:
+                st.download_button(
+                    "💾 Download DAX",
+                    st.session_state.generated_dax_bytes,
+                    "narrative.dax",
+                    "text/plain",
+                    use_container_width=True
+                )
+            with col3:
+                # Clipboard write happens in the browser, so copying does
+                # not trigger a server rerun the way st.button would.
+                # json.dumps leaves '</' intact, so escape it or a
+                # '</script>' in user text (e.g. the report title) would
+                # terminate the script tag early
+                dax_js = json.dumps(final_dax).replace('</', '<\\/')
+                components.html(
+                    "<button onclick=\"navigator.clipboard.writeText(window._dax);"
+                    "this.innerText='✅ Copied';\" "
+                    "style='width:100%; padding:8px 12px; border:1px solid #d6d6d9; "
+                    "border-radius:8px; background:white; cursor:pointer; "
+                    "font-family:inherit; font-size:14px;'>📋 Copy Code</button>"
+                    f"<script>window._dax = {dax_js};</script>",
+                    height=46
+                )
+
+            # Rendered lazily so the common rerun doesn't ship the whole
+            # highlighted payload to the browser; very large outputs only
+            # preview their head to keep client-side highlighting sane
+            with st.expander("🔍 View generated DAX", expanded=False):
+                if len(final_dax) > 50_000:
+                    st.caption("Showing the first 200 lines — use Download DAX for the full measure")
+                    st.code("\n".join(final_dax.split("\n", 201)[:200]), language='dax')
+                else:
+                    st.code(final_dax, language='dax')
 
 if __name__ == "__main__":
     main()